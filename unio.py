@@ -2,6 +2,7 @@ import io
 import os
 import sys
 import codecs
+import weakref
 import contextlib
 
 
@@ -11,6 +12,19 @@ import contextlib
 has_likely_buggy_unicode_filesystem = \
     sys.platform.startswith('linux') or 'bsd' in sys.platform
 
+# Results of is_ascii_encoding keyed by the encoding name as given.  This
+# is bounded so that random junk passed in cannot grow it forever.
+_ascii_encoding_cache = {}
+_ascii_encoding_cache_size = 128
+
+# The names ASCII is most commonly known under, normalized the same way
+# the codecs module does it.  These do not need a codec lookup.
+_ascii_aliases = frozenset([
+    'ascii', 'us_ascii', 'us', 'ansi_x3.4_1968', 'ansi_x3_4_1968',
+    'ansi_x3.4_1986', '646', 'iso646_us', 'iso_646.irv_1991', 'iso_ir_6',
+    'cp367', 'ibm367', 'csascii',
+])
+
 
 def is_ascii_encoding(encoding):
     """Given an encoding this figures out if the encoding is actually ASCII
@@ -19,11 +33,43 @@ def is_ascii_encoding(encoding):
     """
     if encoding is None:
         return False
-    try:
-        codec = codecs.lookup(encoding)
-    except LookupError:
-        return False
-    return codec.name == 'ascii'
+    rv = _ascii_encoding_cache.get(encoding)
+    if rv is not None:
+        return rv
+    if encoding.lower().replace('-', '_').replace(' ', '_') \
+       in _ascii_aliases:
+        rv = True
+    else:
+        try:
+            rv = codecs.lookup(encoding).name == 'ascii'
+        except LookupError:
+            rv = False
+    if len(_ascii_encoding_cache) >= _ascii_encoding_cache_size:
+        _ascii_encoding_cache.clear()
+    _ascii_encoding_cache[encoding] = rv
+    return rv
+
+
+def _compute_filesystem_encoding():
+    if has_likely_buggy_unicode_filesystem:
+        return 'utf-8'
+    rv = sys.getfilesystemencoding()
+    if is_ascii_encoding(rv):
+        return 'utf-8'
+    return rv
+
+
+def _compute_std_stream_encoding():
+    rv = sys.getdefaultencoding()
+    if is_ascii_encoding(rv):
+        return 'utf-8'
+    return rv
+
+
+# Neither of these can change over the lifetime of the process so we only
+# figure them out once.
+_filesystem_encoding = _compute_filesystem_encoding()
+_std_stream_encoding = _compute_std_stream_encoding()
 
 
 def get_filesystem_encoding():
@@ -36,12 +82,7 @@ def get_filesystem_encoding():
     you should rely on.  As such if you ever need to use this function
     except for writing wrapper code reconsider.
     """
-    if has_likely_buggy_unicode_filesystem:
-        return 'utf-8'
-    rv = sys.getfilesystemencoding()
-    if is_ascii_encoding(rv):
-        return 'utf-8'
-    return rv
+    return _filesystem_encoding
 
 
 def get_file_encoding(for_writing=False):
@@ -58,10 +99,7 @@ def get_file_encoding(for_writing=False):
 
 def get_std_stream_encoding():
     """Returns the default stream encoding if not found."""
-    rv = sys.getdefaultencoding()
-    if is_ascii_encoding(rv):
-        return 'utf-8'
-    return rv
+    return _std_stream_encoding
 
 
 class BrokenEnvironment(Exception):
@@ -86,26 +124,58 @@ class _FixupStream(object):
     some circumstances.
     """
 
+    # The methods the io module calls all the time are bound directly
+    # on the instance so that they do not need to go through __getattr__.
+    _forwarded_methods = ('read', 'write', 'flush', 'close', 'fileno',
+                          'isatty')
+
+    __slots__ = ('_stream', '_readable', '_writable', '_seekable') + \
+        _forwarded_methods
+
     def __init__(self, stream):
         self._stream = stream
+        self._readable = None
+        self._writable = None
+        self._seekable = None
+        for name in self._forwarded_methods:
+            func = getattr(stream, name, None)
+            if func is not None:
+                setattr(self, name, func)
 
     def __getattr__(self, name):
         return getattr(self._stream, name)
 
     def readable(self):
-        x = getattr(self._stream, 'readable', None)
-        if x is not None:
-            return x
+        if self._readable is None:
+            self._readable = self._probe_readable()
+        return self._readable
+
+    def writable(self):
+        if self._writable is None:
+            self._writable = self._probe_writable()
+        return self._writable
+
+    def seekable(self):
+        if self._seekable is None:
+            self._seekable = self._probe_seekable()
+        return self._seekable
+
+    def _probe_readable(self):
+        try:
+            return self._stream.readable()
+        except AttributeError:
+            pass
         try:
             self._stream.read(0)
         except Exception:
             return False
         return True
 
-    def writable(self):
-        x = getattr(self._stream, 'writable', None)
-        if x is not None:
-            return x
+    def _probe_writable(self):
+        try:
+            return self._stream.writable()
+        except AttributeError:
+            pass
         try:
             self._stream.write('')
         except Exception:
@@ -115,10 +185,11 @@ class _FixupStream(object):
                 return False
         return True
 
-    def seekable(self):
-        x = getattr(self._stream, 'seekable', None)
-        if x is not None:
-            return x
+    def _probe_seekable(self):
+        try:
+            return self._stream.seekable()
+        except AttributeError:
+            pass
         try:
             self._stream.seek(self._stream.tell())
         except Exception:
@@ -126,6 +197,14 @@ class _FixupStream(object):
         return True
 
 
+def _make_text_wrapper(stream, encoding, errors):
+    # Streams from the io module already implement everything the text
+    # wrapper needs so only other streams have to be fixed up.
+    if not isinstance(stream, (io.RawIOBase, io.BufferedIOBase)):
+        stream = _FixupStream(stream)
+    return _NonClosingTextIOWrapper(stream, encoding, errors)
+
+
 PY2 = sys.version_info[0] == 2
 if PY2:
     import StringIO
@@ -140,7 +219,7 @@ if PY2:
             encoding = get_std_stream_encoding()
         if errors is None:
             errors = 'replace'
-        return _NonClosingTextIOWrapper(_FixupStream(stream), encoding, errors)
+        return _make_text_wrapper(stream, encoding, errors)
 
     def get_binary_stdin():
         return sys.stdin
@@ -198,6 +277,12 @@ else:
     NativeIO = io.StringIO
 
     def _is_binary_reader(stream, default=False):
+        # Streams from the io module tell us what they are by their type.
+        # Only unknown streams need to be probed.
+        if isinstance(stream, (io.RawIOBase, io.BufferedIOBase)):
+            return True
+        if isinstance(stream, io.TextIOBase):
+            return False
         try:
             return isinstance(stream.read(0), bytes)
         except Exception:
@@ -206,6 +291,10 @@ else:
             # closed.  In this case we assume the defalt.
 
     def _is_binary_writer(stream, default=False):
+        if isinstance(stream, (io.RawIOBase, io.BufferedIOBase)):
+            return True
+        if isinstance(stream, io.TextIOBase):
+            return False
         try:
             stream.write(b'')
         except Exception:
@@ -217,14 +306,13 @@ else:
             return default
         return True
 
-    def _find_binary_reader(stream):
+    def _find_binary_reader(stream, already_not_binary=False):
         # We need to figure out if the given stream is already binary.
         # This can happen because the official docs recommend detatching
         # the streams to get binary streams.  Some code might do this, so
-        # we need to deal with this case explicitly.
-        is_binary = _is_binary_reader(stream, False)
-
-        if is_binary:
+        # we need to deal with this case explicitly.  Callers that already
+        # checked this can tell us so.
+        if not already_not_binary and _is_binary_reader(stream, False):
             return stream
 
         buf = getattr(stream, 'buffer', None)
@@ -233,12 +321,13 @@ else:
         if buf is not None and _is_binary_reader(buf, True):
             return buf
 
-    def _find_binary_writer(stream):
+    def _find_binary_writer(stream, already_not_binary=False):
         # We need to figure out if the given stream is already binary.
         # This can happen because the official docs recommend detatching
         # the streams to get binary streams.  Some code might do this, so
-        # we need to deal with this case explicitly.
-        if _is_binary_writer(stream, False):
+        # we need to deal with this case explicitly.  Callers that already
+        # checked this can tell us so.
+        if not already_not_binary and _is_binary_writer(stream, False):
             return stream
 
         buf = getattr(stream, 'buffer', None)
@@ -248,42 +337,34 @@ else:
         if buf is not None and _is_binary_reader(buf, True):
             return buf
 
-    def _stream_is_misconfigured(stream):
-        """A stream is misconfigured if it's encoding is ASCII."""
-        return is_ascii_encoding(getattr(stream, 'encoding', None))
-
     def _wrap_stream_for_text(stream, encoding, errors):
         if errors is None:
             errors = 'replace'
         if encoding is None:
             encoding = get_std_stream_encoding()
-        return _NonClosingTextIOWrapper(_FixupStream(stream), encoding, errors)
-
-    def _is_compatible_text_stream(stream, encoding, errors):
-        stream_encoding = getattr(stream, 'encoding', None)
-        stream_errors = getattr(stream, 'errors', None)
-
-        # Perfect match.
-        if stream_encoding == encoding and stream_errors == errors:
-            return True
-
-        # Otherwise it's only a compatible stream if we did not ask for
-        # an encoding.
-        if encoding is None:
-            return stream_encoding is not None
-
-        return False
+        return _make_text_wrapper(stream, encoding, errors)
 
     def _force_correct_text_reader(text_reader, encoding, errors):
+        # Check the encoding of the reader first.  If it's a text reader
+        # that already does what we want we can return it without having
+        # to figure out if it's binary.  If there is no target encoding
+        # set we need to verify that the reader is actually not
+        # misconfigured (which is the case if its encoding is ASCII).
+        stream_encoding = getattr(text_reader, 'encoding', None)
+        if stream_encoding is not None:
+            if encoding is None:
+                if not is_ascii_encoding(stream_encoding):
+                    return text_reader
+            elif stream_encoding == encoding and \
+                    getattr(text_reader, 'errors', None) == errors:
+                return text_reader
+
         if _is_binary_reader(text_reader, False):
             binary_reader = text_reader
         else:
-            # If there is no target encoding set we need to verify that the
-            # reader is actually not misconfigured.
-            if encoding is None and not _stream_is_misconfigured(text_reader):
-                return text_reader
-
-            if _is_compatible_text_stream(text_reader, encoding, errors):
+            # Without an encoding on either side there is nothing we
+            # could fix.
+            if encoding is None and stream_encoding is None:
                 return text_reader
 
             # If the reader has no encoding we try to find the underlying
@@ -291,7 +372,8 @@ else:
             # misconfigured, we silently go with the same reader because this
             # is too common to happen.  In that case mojibake is better than
             # exceptions.
-            binary_reader = _find_binary_reader(text_reader)
+            binary_reader = _find_binary_reader(text_reader,
+                                                already_not_binary=True)
             if binary_reader is None:
                 return text_reader
 
@@ -303,15 +385,26 @@ else:
         return _wrap_stream_for_text(binary_reader, encoding, errors)
 
     def _force_correct_text_writer(text_writer, encoding, errors):
+        # Check the encoding of the writer first.  If it's a text writer
+        # that already does what we want we can return it without having
+        # to figure out if it's binary.  If there is no target encoding
+        # set we need to verify that the writer is actually not
+        # misconfigured (which is the case if its encoding is ASCII).
+        stream_encoding = getattr(text_writer, 'encoding', None)
+        if stream_encoding is not None:
+            if encoding is None:
+                if not is_ascii_encoding(stream_encoding):
+                    return text_writer
+            elif stream_encoding == encoding and \
+                    getattr(text_writer, 'errors', None) == errors:
+                return text_writer
+
         if _is_binary_writer(text_writer, False):
             binary_writer = text_writer
         else:
-            # If there is no target encoding set we need to verify that the
-            # writer is actually not misconfigured.
-            if encoding is None and not _stream_is_misconfigured(text_writer):
-                return text_writer
-
-            if _is_compatible_text_stream(text_writer, encoding, errors):
+            # Without an encoding on either side there is nothing we
+            # could fix.
+            if encoding is None and stream_encoding is None:
                 return text_writer
 
             # If the writer has no encoding we try to find the underlying
@@ -319,7 +412,8 @@ else:
             # misconfigured, we silently go with the same writer because this
             # is too common to happen.  In that case mojibake is better than
             # exceptions.
-            binary_writer = _find_binary_writer(text_writer)
+            binary_writer = _find_binary_writer(text_writer,
+                                                already_not_binary=True)
             if binary_writer is None:
                 return text_writer
 
@@ -330,26 +424,42 @@ else:
             errors = 'replace'
         return _wrap_stream_for_text(binary_writer, encoding, errors)
 
-    def get_binary_stdin():
-        reader = _find_binary_reader(sys.stdin)
-        if reader is None:
+    # Maps the name of a standard stream to weak references to the last
+    # stream object we saw there and the binary stream we found for it.
+    # If the standard stream gets replaced the entry no longer matches and
+    # is looked up again.  The references are weak so that we do not keep
+    # streams alive that were only temporarily installed (for instance by
+    # capture_stdout).
+    _binary_std_streams = {}
+
+    def _get_binary_std_stream(name, find_binary):
+        stream = getattr(sys, name)
+        cached = _binary_std_streams.get(name)
+        if cached is not None and cached[0]() is stream:
+            rv = cached[1]()
+            if rv is not None:
+                return rv
+        rv = find_binary(stream)
+        if rv is None:
             raise BrokenEnvironment('Was not able to determine binary '
-                                    'stream for sys.stdin.')
-        return reader
+                                    'stream for sys.%s.' % name)
+        try:
+            _binary_std_streams[name] = (weakref.ref(stream),
+                                         weakref.ref(rv))
+        except TypeError:
+            # Not all stream objects can be weakly referenced.  Those are
+            # just not cached.
+            _binary_std_streams.pop(name, None)
+        return rv
+
+    def get_binary_stdin():
+        return _get_binary_std_stream('stdin', _find_binary_reader)
 
     def get_binary_stdout():
-        writer = _find_binary_writer(sys.stdout)
-        if writer is None:
-            raise BrokenEnvironment('Was not able to determine binary '
-                                    'stream for sys.stdout.')
-        return writer
+        return _get_binary_std_stream('stdout', _find_binary_writer)
 
     def get_binary_stderr():
-        writer = _find_binary_writer(sys.stderr)
-        if writer is None:
-            raise BrokenEnvironment('Was not able to determine binary '
-                                    'stream for sys.stderr.')
-        return writer
+        return _get_binary_std_stream('stderr', _find_binary_writer)
 
     def get_text_stdin(encoding=None, errors=None):
         return _force_correct_text_reader(sys.stdin, encoding, errors)
@@ -361,8 +471,7 @@ else:
         return _force_correct_text_writer(sys.stderr, encoding, errors)
 
     def get_binary_argv():
-        fs_enc = sys.getfilesystemencoding()
-        return [x.encode(fs_enc, 'surrogateescape') for x in sys.argv]
+        return list(map(os.fsencode, sys.argv))
 
     binary_env = os.environb
 
@@ -373,14 +482,14 @@ else:
             if _is_binary_reader(stream):
                 raise TypeError('Standard input stream cannot be set to a '
                                 'binary reader directly.')
-            if _find_binary_reader(stream) is None:
+            if _find_binary_reader(stream, already_not_binary=True) is None:
                 raise TypeError('Standard input stream needs to be backed '
                                 'by a binary stream.')
         elif stream_type in ('stdout', 'stderr'):
             if _is_binary_writer(stream):
                 raise TypeError('Standard output stream cannot be set to a '
                                 'binary writer directly.')
-            if _find_binary_writer(stream) is None:
+            if _find_binary_writer(stream, already_not_binary=True) is None:
                 raise TypeError('Standard output and error streams need '
                                 'to be backed by a binary streams.')
         else:
@@ -396,15 +505,18 @@ else:
         on Python 3.
         """
 
-        def __init__(self, stream):
+        __slots__ = ('_stream', '_raw_stream')
+
+        def __init__(self, stream, raw_stream):
             self._stream = stream
+            self._raw_stream = raw_stream
 
         def __getattr__(self, name):
             return getattr(self._stream, name)
 
         def getvalue(self):
             self._stream.flush()
-            return self._stream.buffer.getvalue()
+            return self._raw_stream.getvalue()
 
         def __repr__(self):
             return repr(self._stream)
@@ -415,10 +527,13 @@ else:
         It also wraps it in a fake object that flushes on getting the
         underlying value.
         """
-        ll_stream = io.BytesIO()
-        stream = _NonClosingTextIOWrapper(ll_stream, sys.stdout.encoding,
-                                          sys.stdout.errors)
+        # The buffered writer collects the encoded output of many small
+        # writes before it ends up in the bytes io.
         old_stdout = sys.stdout
+        ll_stream = io.BytesIO()
+        buffered_stream = io.BufferedWriter(ll_stream, buffer_size=65536)
+        stream = _NonClosingTextIOWrapper(buffered_stream, old_stdout.encoding,
+                                          old_stdout.errors)
         sys.stdout = stream
 
         if and_stderr:
@@ -426,7 +541,7 @@ else:
             sys.stderr = stream
 
         try:
-            yield _CapturedStream(stream)
+            yield _CapturedStream(stream, ll_stream)
         finally:
             stream.flush()
             sys.stdout = old_stdout
@@ -434,24 +549,34 @@ else:
                 sys.stderr = old_stderr
 
 
-def _fixup_path(path):
-    if has_likely_buggy_unicode_filesystem \
-       and isinstance(path, text_type):
-        if PY2:
-            path = path.encode(get_filesystem_encoding())
-        else:
-            path = path.encode(get_filesystem_encoding(),
-                               'surrogateescape')
-    return path
+# Pick the path fixup function once so that open() does not need to
+# check the platform and Python version every time.
+if not has_likely_buggy_unicode_filesystem:
+    def _fixup_path(path):
+        return path
+elif PY2:
+    def _fixup_path(path, _text_type=text_type,
+                    _fs_encoding=get_filesystem_encoding()):
+        if isinstance(path, _text_type):
+            path = path.encode(_fs_encoding)
+        return path
+else:
+    def _fixup_path(path, _text_type=text_type,
+                    _fs_encoding=get_filesystem_encoding()):
+        if isinstance(path, _text_type):
+            path = path.encode(_fs_encoding, 'surrogateescape')
+        return path
 
 
 def open(filename, mode='r', encoding=None, errors=None):
     """Opens a file either in text or binary mode.  The encoding for the
     file is automatically detected.
     """
-    filename = _fixup_path(filename)
-    if 'b' not in mode:
+    if isinstance(filename, text_type):
+        filename = _fixup_path(filename)
+    if 'b' in mode:
+        if encoding is None:
+            return io.open(filename, mode)
+    else:
         encoding = get_file_encoding('w' in mode)
-    if encoding is not None:
-        return io.open(filename, mode, encoding=encoding, errors=errors)
-    return io.open(filename, mode)
+    return io.open(filename, mode, encoding=encoding, errors=errors)